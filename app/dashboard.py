@@ -1,21 +1,54 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import io
+from collections import defaultdict
 
 from streamlit import session_state as ss
 
+MAX_BARS = 30
+CATEGORY_COLUMNS = ("Подразделение", "Операция", "Культура")
+
+
+def _optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return df
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype("category")
+    # площади хранятся целыми, вал оставляем float64, чтобы не терять точность
+    for col in ("За день, га", "С начала операции, га"):
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    df["id"] = df["id"].astype(np.int32)
+    return df
+
+
+def _hash_df(df: pd.DataFrame) -> tuple:
+    return (
+        tuple(df.columns),
+        len(df),
+        int(pd.util.hash_pandas_object(df, index=False).sum()),
+    )
+
+
+@st.cache_data
+def _load_demo() -> pd.DataFrame:
+    df = pd.read_excel("app/примеры.xlsx", engine="calamine", parse_dates=["Дата"])
+    df.insert(0, "id", np.arange(len(df)))
+    return _optimize_dtypes(df)
+
+
 # для демо дашборда
 try:
     from db.interaction import get_all_operations, update_record_by_id
-    ss.df = get_all_operations()
+    ss.df = _optimize_dtypes(get_all_operations())
     ss.demo = False
+    # ключ кэша считается один раз на загрузку, а не при каждом обращении к кэшу
+    ss.data_key = _hash_df(ss.df)
 except ModuleNotFoundError:
     ss.demo = True
-    ss.df = pd.read_excel("app/примеры.xlsx")
-    ss.df["Дата"] = pd.to_datetime(ss.df["Дата"], dayfirst=True)
-    ss.df["id"] = range(len(ss.df))
-    ss.df = ss.df[[ss.df.columns.tolist()[-1]] + ss.df.columns.tolist()[:-1]]
+    ss.df = _load_demo()
+    ss.data_key = "demo"
 
 
 def load_session_state():
@@ -26,6 +59,30 @@ def load_session_state():
         ss.end_date = ss.today
 
 
+@st.cache_data(max_entries=8)
+def _build_xlsx(_df: pd.DataFrame, df_key: tuple, report_name: str) -> bytes:
+    # кадр не хэшируется (префикс "_"), кэш различает данные по df_key
+    output = io.BytesIO()
+
+    report_df = _df.assign(**{"Дата": _df["Дата"].dt.strftime("%d.%m.%Y")})
+    report_df = report_df.astype(object).where(report_df.notna(), None)
+
+    with pd.ExcelWriter(
+        output,
+        engine="xlsxwriter",
+        engine_kwargs={"options": {"constant_memory": True}},
+    ) as writer:
+        # constant_memory сбрасывает строки во временный файл по мере записи
+        # (с in_memory XlsxWriter его отключает), а to_excel заполняет лист
+        # по столбцам, поэтому пишем таблицу построчно
+        worksheet = writer.book.add_worksheet("Отчет")
+        worksheet.write_row(0, 0, report_df.columns)
+        for row_idx, row in enumerate(report_df.itertuples(index=False), start=1):
+            worksheet.write_row(row_idx, 0, row)
+
+    return output.getvalue()
+
+
 def create_sidebar():
     st.sidebar.header("Фильтры")
     ss.date_option = st.sidebar.radio(
@@ -44,13 +101,13 @@ def create_sidebar():
 
         ss.df = ss.df[ss.df["Дата"] == ss.today]
 
-    output = io.BytesIO()
-
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        ss.df["Дата"] = ss.df["Дата"].dt.strftime("%d.%m.%Y")
-        ss.df.to_excel(writer, index=False, sheet_name="Отчет")
-
-    output.seek(0)
+    ss.df_key = (
+        ss.data_key,
+        ss.date_option,
+        str(ss.start_date),
+        str(ss.end_date),
+        str(ss.today),
+    )
 
     report_name = (
         f"Отчёт {ss.start_date} - {ss.end_date}.xlsx"
@@ -59,29 +116,42 @@ def create_sidebar():
     )
     st.sidebar.download_button(
         label="Скачать отчет за выбранный\n\nпериод в Excel",
-        data=output,
+        data=_build_xlsx(ss.df, ss.df_key, report_name),
         file_name=report_name,
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         type="primary",
     )
 
 
+def _sorted_options(col: str) -> list:
+    values = ss.df[col]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # категории уже отсортированы, отбрасываем отфильтрованные по дате
+        return values.cat.remove_unused_categories().cat.categories.tolist()
+    return sorted(values.dropna().unique())
+
+
+@st.cache_data(max_entries=16)
+def _agg_by(_df: pd.DataFrame, df_key: tuple, by: tuple[str, ...]) -> pd.DataFrame:
+    return (
+        _df.groupby(list(by), observed=True)
+        .agg({"За день, га": "sum", "С начала операции, га": "sum"})
+        .reset_index()
+    )
+
+
 def cultures_figure():
     selected_culture = st.selectbox(
-        "Выберите культуру:", sorted(ss.df["Культура"].unique())
+        "Выберите культуру:", _sorted_options("Культура")
     )
-    filtered_df = ss.df[ss.df["Культура"] == selected_culture]
+    grouped_df = _agg_by(ss.df, ss.df_key, ("Культура", "Операция"))
+    filtered_df = grouped_df[grouped_df["Культура"] == selected_culture]
 
     if filtered_df.empty:
         st.warning("Нет данных для выбранной культуры.")
     else:
-        agg_df = (
-            filtered_df.groupby("Операция")
-            .agg({"За день, га": "sum", "С начала операции, га": "sum"})
-            .reset_index()
-            .melt(
-                id_vars="Операция", var_name="Тип показателя", value_name="Площадь, га"
-            )
+        agg_df = filtered_df.drop(columns="Культура").melt(
+            id_vars="Операция", var_name="Тип показателя", value_name="Площадь, га"
         )
 
         fig = px.bar(
@@ -101,15 +171,13 @@ def cultures_figure():
 
 
 def operations_figure():
-    operation_list = sorted(ss.df["Операция"].unique())
+    operation_list = _sorted_options("Операция")
     selected_operation = st.selectbox("Выберите операцию:", operation_list)
 
-    op_df = ss.df[ss.df["Операция"] == selected_operation]
-    group_op = (
-        op_df.groupby("Культура")
-        .agg({"За день, га": "sum", "С начала операции, га": "sum"})
-        .reset_index()
-        .melt(id_vars="Культура", var_name="Тип показателя", value_name="Площадь, га")
+    agg_df = _agg_by(ss.df, ss.df_key, ("Операция", "Культура"))
+    op_df = agg_df[agg_df["Операция"] == selected_operation]
+    group_op = op_df.drop(columns="Операция").melt(
+        id_vars="Культура", var_name="Тип показателя", value_name="Площадь, га"
     )
 
     if group_op.empty:
@@ -132,17 +200,33 @@ def operations_figure():
 
 
 def divisions_figure():
-    division_list = sorted(ss.df["Подразделение"].unique())
+    division_list = _sorted_options("Подразделение")
     selected_division = st.selectbox("Выберите подразделение:", division_list)
 
-    div_df = ss.df[ss.df["Подразделение"] == selected_division]
+    agg_df = _agg_by(ss.df, ss.df_key, ("Подразделение", "Операция", "Культура"))
+    div_df = agg_df[agg_df["Подразделение"] == selected_division]
 
-    group_summary = (
-        div_df.groupby(["Операция", "Культура"])["За день, га"].sum().reset_index()
-    )
-    group_summary = group_summary.fillna(0)
+    group_summary = div_df[["Операция", "Культура", "За день, га"]].copy()
+    # fillna по всей таблице падает на категориальных колонках
+    group_summary["За день, га"] = group_summary["За день, га"].fillna(0)
     group_summary = group_summary[group_summary["За день, га"] > 0]
 
+    # оставляем крупнейшие столбцы, остальные объединяем в "Прочие"
+    top = group_summary.nlargest(MAX_BARS, "За день, га")
+    rest = group_summary.drop(top.index)
+    if not rest.empty:
+        other = pd.DataFrame(
+            [
+                {
+                    "Операция": "Прочие",
+                    "Культура": "Прочие",
+                    "За день, га": rest["За день, га"].sum(),
+                }
+            ]
+        )
+        top = pd.concat([top, other], ignore_index=True)
+    group_summary = top
+
     if group_summary.empty:
         st.warning("Нет данных по выбранному подразделению.")
     else:
@@ -158,6 +242,7 @@ def divisions_figure():
             height=600,
         )
         fig_summary.update_layout(title_x=0.5, bargap=0.0, bargroupgap=0.0)
+        fig_summary.update_traces(marker_line_width=0)
         st.plotly_chart(fig_summary, use_container_width=True)
 
 def manage_data():
@@ -165,38 +250,39 @@ def manage_data():
         "**При необходимости изменения данных отредактируйте требуемые значения в ячейках таблицы**"
     )
 
-    # Используем data_editor для редактирования
+    # Используем data_editor для редактирования; категориальные колонки
+    # редактор показывает списком существующих значений, поэтому отдаём строки
     edited_df = st.data_editor(
-        ss.df,
+        ss.df.astype({col: object for col in CATEGORY_COLUMNS}),
         use_container_width=True,
         num_rows="fixed",
         hide_index=True,
-        disabled=['id']
+        disabled=['id'],
+        key="editor",
     )
     if st.button("**Обновить таблицу в Базе Данных**", type='primary'):
-        changes = edited_df.compare(ss.df)
-        updates = {}
-
-        for idx in changes.index:
-            row_changes = changes.loc[idx]
-            new_values = {}
-
-            for col in edited_df.columns:
-                if (col, 'self') in row_changes and (col, 'other') in row_changes:
-                    new_value = row_changes[(col, 'self')]
-                    old_value = row_changes[(col, 'other')]
-                    if pd.notna(new_value) and new_value != old_value:
-                        new_values[col] = new_value
-
-            if new_values:
-                row_id = int(edited_df.loc[idx, "id"])  # <-- приведение к int
-                updates[row_id] = new_values
+        # edited_rows хранит только изменённые ячейки: {позиция строки: {колонка: значение}}
+        edited_rows = ss["editor"]["edited_rows"]
+        updates = defaultdict(dict)
+
+        for pos, row_changes in edited_rows.items():
+            pos = int(pos)
+            row_id = int(ss.df["id"].iat[pos])  # <-- приведение к int
+            for col in row_changes:
+                new_value = edited_df[col].iat[pos]
+                if pd.notna(new_value) and new_value != ss.df[col].iat[pos]:
+                    # psycopg2 не умеет адаптировать numpy-скаляры
+                    if isinstance(new_value, np.generic):
+                        new_value = new_value.item()
+                    updates[row_id][col] = new_value
 
         if updates:
             if not ss.demo:
-                update_record_by_id(list(updates.keys()), list(updates.values()))
+                for row_id, row_updates in updates.items():
+                    update_record_by_id(row_id, row_updates)
             st.success('Данные успешно обновлены', icon='✅')
             ss.df = edited_df
+            ss.df_key = _hash_df(edited_df)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,20 @@
+import math
 from pathlib import Path
 
 import cv2
 import numpy as np
 from numpy.typing import NDArray
-from skimage.filters import threshold_sauvola
+
+# Gaussian(5x5) followed by Gaussian(sigma=3) equals a single Gaussian with
+# sigma = sqrt(sigma_5x5^2 + 3^2); sigma_5x5 is OpenCV's default for ksize 5
+_NOISE_SIGMA = 0.3 * ((5 - 1) * 0.5 - 1) + 0.8
+_UNSHARP_SIGMA = math.hypot(_NOISE_SIGMA, 3)
+_UNSHARP_KERNEL = cv2.getGaussianKernel(
+    int(round(_UNSHARP_SIGMA * 6 + 1)) | 1, _UNSHARP_SIGMA
+)
+_DILATE_KERNEL = np.ones((3, 3), np.uint8)
+# Contours at least this rectangle-like stop the search early
+_GOOD_RECT_RATIO = 0.9
 
 
 def order_points(pts: NDArray[np.uint8]) -> NDArray[np.uint8]:
@@ -16,24 +27,48 @@ def order_points(pts: NDArray[np.uint8]) -> NDArray[np.uint8]:
     Returns:
         NDArray[np.uint8]: Ordered points
     """
-    rect = np.zeros((4, 2), dtype="float32")
+    pts = pts.astype(np.float32, copy=False)
+    rect = np.empty((4, 2), dtype=np.float32)
 
-    # top-left point has the smallest sum
-    # bottom-right point has the largest sum
-    s = pts.sum(axis=1)
-    rect[0] = pts[np.argmin(s)]
-    rect[2] = pts[np.argmax(s)]
+    # top-left point has the smallest x + y, bottom-right the largest
+    s = pts[:, 0] + pts[:, 1]
+    rect[0] = pts[s.argmin()]
+    rect[2] = pts[s.argmax()]
 
-    # compute the difference between the points
-    # top-right has the smallest difference
-    # bottom-left has the largest difference
-    diff = np.diff(pts, axis=1)
-    rect[1] = pts[np.argmin(diff)]
-    rect[3] = pts[np.argmax(diff)]
+    # top-right point has the largest x - y, bottom-left the smallest
+    d = pts[:, 0] - pts[:, 1]
+    rect[1] = pts[d.argmax()]
+    rect[3] = pts[d.argmin()]
 
     return rect
 
 
+def sauvola_binarize(
+    image: NDArray[np.uint8], window_size: int = 15, k: float = 0.2
+) -> NDArray[np.uint8]:
+    """
+    Binarize an image with Sauvola local thresholding.
+
+    Local mean and standard deviation are computed with OpenCV box filters
+    in float32, matching skimage's threshold_sauvola for uint8 input.
+
+    Args:
+        image: Grayscale uint8 image
+        window_size: Odd size of the local window
+        k: Sauvola sensitivity parameter
+
+    Returns:
+        NDArray[np.uint8]: Binary image with values 0 and 255
+    """
+    r = 127.5  # half of the uint8 dynamic range
+    ksize = (window_size, window_size)
+    mean = cv2.boxFilter(image, cv2.CV_32F, ksize)
+    sqmean = cv2.sqrBoxFilter(image, cv2.CV_32F, ksize)
+    std = np.sqrt(np.maximum(sqmean - mean * mean, 0, out=sqmean), out=sqmean)
+    threshold = mean * (1 + k * (std / r - 1))
+    return (image > threshold).astype(np.uint8) * 255
+
+
 def preprocess_image(image_path: str) -> str:
     """
     Process a screenshot of an Excel table by binarizing, finding table boundaries,
@@ -50,34 +85,45 @@ def preprocess_image(image_path: str) -> str:
     # Convert to grayscale
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
+    # Ping-pong buffers reused by the intermediate steps below
+    buf0 = np.empty_like(gray)
+    buf1 = np.empty_like(gray)
+
     # Normalize brightness and contrast
     # 1. CLAHE (Contrast Limited Adaptive Histogram Equalization)
+    # created per call: a CLAHE object keeps internal buffers and is not
+    # safe to share between the threads that run attachment extraction
     clahe = cv2.createCLAHE(clipLimit=0.5, tileGridSize=(8, 8))
-    normalized = clahe.apply(gray)
+    equalized = clahe.apply(gray, buf0)
 
-    # 2. Normalize to full dynamic range
-    normalized = cv2.normalize(normalized, None, 0, 255, cv2.NORM_MINMAX)
+    # 2. Normalize to full dynamic range (gray is no longer needed)
+    normalized = cv2.normalize(equalized, gray, 0, 255, cv2.NORM_MINMAX)
 
     # 3. Apply Gaussian blur to reduce noise
-    blur = cv2.GaussianBlur(normalized, (5, 5), 0)
+    blur = cv2.GaussianBlur(normalized, (5, 5), 0, dst=buf0)
 
-    # 4. Enhance contrast with unsharp mask
-    gaussian = cv2.GaussianBlur(blur, (0, 0), 3)
-    unsharp_mask = cv2.addWeighted(blur, 1.5, gaussian, -0.5, 0)
+    # 4. Enhance contrast with unsharp mask (both blurs fused into one pass)
+    gaussian = cv2.sepFilter2D(
+        normalized, -1, _UNSHARP_KERNEL, _UNSHARP_KERNEL, dst=buf1
+    )
+    unsharp_mask = cv2.addWeighted(blur, 1.5, gaussian, -0.5, 0, dst=buf1)
 
     # Edge detection
-    edges = cv2.Canny(unsharp_mask, 40, 100, apertureSize=3)
+    edges = cv2.Canny(unsharp_mask, 40, 100, edges=buf0, apertureSize=3)
 
     # Dilate to connect edge fragments
-    kernel = np.ones((3, 3), np.uint8)
-    dilated = cv2.dilate(edges, kernel, iterations=1)
+    dilated = cv2.dilate(edges, _DILATE_KERNEL, dst=buf1, iterations=1)
 
     # Find contours
     contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    # Filter contours by area and shape
+    # Filter contours by area and sort them from largest to smallest
     min_area = 0.1 * img.shape[0] * img.shape[1]  # At least 10% of image
-    filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > min_area]
+    filtered_contours = sorted(
+        (cnt for cnt in contours if cv2.contourArea(cnt) > min_area),
+        key=cv2.contourArea,
+        reverse=True,
+    )
 
     if filtered_contours:
         # Find the contour that most resembles a rectangle
@@ -102,9 +148,13 @@ def preprocess_image(image_path: str) -> str:
                     best_score = area_ratio
                     best_contour = approx
 
+                # The largest rectangle-like contour is good enough
+                if area_ratio >= _GOOD_RECT_RATIO:
+                    break
+
         # If we didn't find a good quadrilateral, use the largest contour
         if best_contour is None:
-            largest_contour = max(filtered_contours, key=cv2.contourArea)
+            largest_contour = filtered_contours[0]
             # Approximate to get a polygon
             epsilon = 0.02 * cv2.arcLength(largest_contour, True)
             best_contour = cv2.approxPolyDP(largest_contour, epsilon, True)
@@ -125,21 +175,10 @@ def preprocess_image(image_path: str) -> str:
             rect = order_points(pts)
 
             # Calculate the width and height of the new image
-            width_a = np.sqrt(
-                ((rect[1][0] - rect[0][0]) ** 2) + ((rect[1][1] - rect[0][1]) ** 2)
-            )
-            width_b = np.sqrt(
-                ((rect[3][0] - rect[2][0]) ** 2) + ((rect[3][1] - rect[2][1]) ** 2)
-            )
-            max_width = max(int(width_a), int(width_b))
-
-            height_a = np.sqrt(
-                ((rect[0][0] - rect[3][0]) ** 2) + ((rect[0][1] - rect[3][1]) ** 2)
-            )
-            height_b = np.sqrt(
-                ((rect[1][0] - rect[2][0]) ** 2) + ((rect[1][1] - rect[2][1]) ** 2)
-            )
-            max_height = max(int(height_a), int(height_b))
+            # sides: top, right, bottom, left
+            sides = np.linalg.norm(rect - rect[[1, 2, 3, 0]], axis=1)
+            max_width = int(max(sides[0], sides[2]))
+            max_height = int(max(sides[1], sides[3]))
 
             # Define destination points for the perspective transform
             dst = np.array(
@@ -157,8 +196,7 @@ def preprocess_image(image_path: str) -> str:
             warped = cv2.warpPerspective(normalized, M, (max_width, max_height))
 
             # Apply adaptive thresholding with Sauvola method (better for document images)
-            thresh_sauvola = threshold_sauvola(warped, window_size=15, k=0.2)
-            warped_binary = (warped > thresh_sauvola).astype(np.uint8) * 255
+            warped_binary = sauvola_binarize(warped, window_size=15, k=0.2)
             output_path = (
                 Path(image_path)
                 .with_stem(Path(image_path).stem + "_binarized")
@@ -168,8 +206,7 @@ def preprocess_image(image_path: str) -> str:
             return output_path
 
     # If no suitable contour found, return the binarized original image using Sauvola thresholding
-    thresh_sauvola = threshold_sauvola(normalized, window_size=15, k=0.2)
-    simple_binary = (normalized > thresh_sauvola).astype(np.uint8) * 255
+    simple_binary = sauvola_binarize(normalized, window_size=15, k=0.2)
     output_path = (
         Path(image_path)
         .with_stem(Path(image_path).stem + "_binarized")
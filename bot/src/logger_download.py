@@ -1,10 +1,17 @@
+import functools
 import logging
 import logging.config
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 LOGGING_CFG_PATH = "bot/src/configs/logging.cfg.yml"
 
 
+@functools.cache
 def get_logger(logging_cfg_path: str = None) -> logging.Logger:
     """
     Create logger object with params from config.
@@ -13,7 +20,7 @@ def get_logger(logging_cfg_path: str = None) -> logging.Logger:
     logging.Logger
     """
     with open(logging_cfg_path) as stream:
-        config = yaml.safe_load(stream.read())
+        config = yaml.load(stream, Loader=SafeLoader)
         logger_name = list(config.get("loggers").keys())[0]
         logger_model = logging.getLogger(logger_name)
         logging.config.dictConfig(config)
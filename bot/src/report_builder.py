@@ -1,11 +1,11 @@
 from __future__ import annotations
 
 import ast
-import json
+import asyncio
 import traceback
-from datetime import datetime
 from typing import List, Optional, Union
 
+import orjson
 from pydantic import (
     BaseModel,
     Field,
@@ -22,7 +22,23 @@ from src.utils import (
 )
 
 ERROR_TEXT = "Ваш отчёт не может быть обработан 😭 Попробуйте переформулировать текст или приложить фото таблицы хорошего качества."
-allowed_entities = load_entities()
+UNDEFINED = "Не определено"
+REPORT_FIELDS = (
+    "За день, га",
+    "С начала операции, га",
+    "Вал за день, ц",
+    "Вал с начала, ц",
+)
+allowed_entities = {
+    key: frozenset(values) | {UNDEFINED} for key, values in load_entities().items()
+}
+
+
+def _parse_json(text: str):
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return ast.literal_eval(text)
 
 
 class OperationEntry(BaseModel):
@@ -44,22 +60,18 @@ class OperationEntry(BaseModel):
 
     @field_validator("Операция")
     def validate_operation(cls, v):
-
-        allowed_entities["type"].append("Не определено")
         if v not in allowed_entities["type"]:
             raise ValueError(f"Операция '{v}' не в списке допустимых.")
         return v
 
     @field_validator("Культура")
     def validate_culture(cls, v):
-        allowed_entities["culture"].append("Не определено")
         if v and v not in allowed_entities["culture"]:
             raise ValueError(f"Культура '{v}' не в списке допустимых.")
         return v
 
     @field_validator("Подразделение")
     def validate_division(cls, v):
-        allowed_entities["division"].append("Не определено")
         if v and v not in allowed_entities["division"]:
             raise ValueError(f"Подразделение '{v}' не в списке допустимых.")
         return v
@@ -79,16 +91,16 @@ class ReportBuilder:
         )
         self.model.set_generation_params(system_prompt=config["assistant_prompt"])
 
-    def _correct_fields(self, report: dict) -> dict:
+    async def _correct_fields(self, report: dict) -> dict:
         logger.warning("🚩 Correcting fields")
         logger.warning(report)
 
         prompt = load_prompt(
             "3. validation_fields.md", validation=True, report=str(report)
         )
-        return self.model.predict(prompt)
+        return await self.model.predict_async(prompt)
 
-    def _correct_json(self, report: str) -> dict:
+    async def _correct_json(self, report: str) -> dict:
         logger.warning("🚩 Correcting JSON structure")
         logger.warning(report)
         prompt = load_prompt(
@@ -96,55 +108,62 @@ class ReportBuilder:
             validation=True,
             report=report,
         )
-        return self.model.predict(prompt, report)
+        return await self.model.predict_async(prompt, report)
+
+    async def _validate(self, reports: str) -> dict:
+        # pandas is only needed here, keep it out of the worker's startup imports
+        import pandas as pd
 
-    def _validate(self, reports: str) -> dict:
         try:
             cleaned = clean_string(reports)
 
             if "Отчёт не может быть обработан." in cleaned:
                 raise ValueError("Poor quality data, nothing to extract")
 
-            parsed = json.loads(cleaned)
+            parsed = orjson.loads(cleaned)
             if isinstance(parsed, list):
                 parsed = [
-                    json.loads(clean_string(item)) if isinstance(item, str) else item
+                    orjson.loads(clean_string(item)) if isinstance(item, str) else item
                     for item in parsed
                 ]
-            for item in parsed:
-                try:
-                    parsed_date = datetime.fromisoformat(item["Дата"])
-                    item["Дата"] = parsed_date.strftime("%d.%m.%Y")
-                except ValueError:
-                    pass
+            dates = pd.to_datetime(
+                [item["Дата"] for item in parsed], format="ISO8601", errors="coerce"
+            ).strftime("%d.%m.%Y")
+            for item, formatted_date in zip(parsed, dates):
+                if pd.notna(formatted_date):
+                    item["Дата"] = formatted_date
 
-            return OperationList.model_validate(parsed).model_dump(exclude_none=True)
+            return OperationList.model_validate(parsed).model_dump(by_alias=True, exclude_none=True)
 
         except ValidationError:
-            correction = self._correct_fields(parsed)
+            correction = await self._correct_fields(parsed)
             return OperationList.model_validate(
-                ast.literal_eval(clean_string(correction))
-            ).model_dump(exclude_none=True)
+                _parse_json(clean_string(correction))
+            ).model_dump(by_alias=True, exclude_none=True)
 
-        except json.decoder.JSONDecodeError:
-            correction = self._correct_json(reports)
+        except orjson.JSONDecodeError:
+            correction = await self._correct_json(reports)
             return OperationList.model_validate(
-                ast.literal_eval(clean_string(correction))
-            ).model_dump(exclude_none=True)
+                _parse_json(clean_string(correction))
+            ).model_dump(by_alias=True, exclude_none=True)
 
         except Exception:
             logger.error("Unexpected error:")
             logger.error(traceback.format_exc())
             raise
 
-    def _gather_raw_results(self, prompt: str, report_data: list[dict]) -> list[str]:
-        reports = []
-        for report in report_data:
-            raw_report = self.model.predict(prompt, str(report))
-            reports.append(raw_report)
-        return reports
+    async def _gather_raw_results(
+        self, prompt: str, report_data: list[dict]
+    ) -> list[str]:
+        semaphore = asyncio.Semaphore(self.config.get("max_workers", 4))
+
+        async def predict(report: dict) -> str:
+            async with semaphore:
+                return await self.model.predict_async(prompt, str(report))
 
-    def _process_stage(
+        return await asyncio.gather(*(predict(report) for report in report_data))
+
+    async def _process_stage(
         self,
         report_data: Union[list[dict], str],
         prompt_path: str,
@@ -152,17 +171,17 @@ class ReportBuilder:
     ) -> list[dict]:
         if initial:
             prompt = load_prompt(prompt_path, definition=True)
-            reports = self.model.predict(prompt, report_data)
+            reports = await self.model.predict_async(prompt, report_data)
             logger.info(reports)
-            return self._validate(reports)
+            return await self._validate(reports)
 
         prompt = load_prompt(prompt_path, definition=False)
-        reports = self._gather_raw_results(prompt, report_data)
-        return self._validate(
-            json.dumps(reports, ensure_ascii=False, indent=2, sort_keys=False)
+        reports = await self._gather_raw_results(prompt, report_data)
+        return await self._validate(
+            orjson.dumps(reports, option=orjson.OPT_INDENT_2).decode()
         )
 
-    def build(self, report_data: str) -> list[dict]:
+    async def build_async(self, report_data: str) -> list[dict]:
         processing_steps = [
             (
                 "1. initial.md",
@@ -175,15 +194,9 @@ class ReportBuilder:
         result = report_data
         for prompt_path, field, initial in processing_steps:
             logger.info(f"Processing step: {field}")
-            result = self._process_stage(result, prompt_path, initial)
-
-        try:
-            for item in result:
-                item["За день, га"] = item.pop("За_день_га")
-                item["С начала операции, га"] = item.pop("С_начала_операции_га")
-                item["Вал за день, ц"] = item.pop("Вал_за_день_ц")
-                item["Вал с начала, ц"] = item.pop("Вал_с_начала_ц")
+            result = await self._process_stage(result, prompt_path, initial)
 
-            return result
-        except Exception:
+        if any(field not in item for item in result for field in REPORT_FIELDS):
             return ERROR_TEXT
+
+        return result
@@ -1,17 +1,19 @@
 from __future__ import annotations
-from datetime import datetime
+import asyncio
 import re
 
-import pandas as pd
 from src.logger_download import logger
-from src.report_builder import ERROR_TEXT
+from src.report_builder import ERROR_TEXT, UNDEFINED
 from src.utils import (
     edit_message_with_retry,
     error_handler,
+    format_table,
     get_reply_text,
     is_allowed,
     manage_attachment,
     message_text,
+    parse_report_date,
+    parse_user_ids,
     send_and_receive,
 )
 from telegram import (
@@ -33,8 +35,39 @@ from telegram.ext import (
 
 from db.interaction import insert_objects
 
+# 25 сообщений в секунду, с запасом до лимита Telegram в 30
+GROUP_SEND_INTERVAL = 1 / 25
+CORRECTION_HEADER = "При заполнении отчёта не удалось распознать некоторые значения, требуется уточнение.\n\n"
+CORRECTION_PROMPT = """Запись {number}. Нераспознанные данные: ```
+{data}```
+
+Введите значение для поля '{key}':"""
+HTML_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+FINAL_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("Финальный отчёт ✅", callback_data="final_yes"),
+            InlineKeyboardButton("Промежуточный отчёт ⚠️", callback_data="final_no"),
+        ]
+    ]
+)
+
+
+def compose_group_report(author: str, report: str, source_text: str) -> str:
+    """
+    Builds the group chat message: formatted report followed by the source text.
+    """
+    return f"Отчёт от {author}:\n\n{report}\nИсходный текст:\n\n{source_text}"
+
 
 class AgroReportTelegramBot:
+    COMMANDS: tuple[BotCommand, ...] = (
+        BotCommand(
+            command="help",
+            description=get_reply_text("help_description"),
+        ),
+    )
+
     def __init__(self, config):
         """
         Initializes the bot with the given configuration and LLM bot object.
@@ -43,14 +76,27 @@ class AgroReportTelegramBot:
         """
 
         self.config = config
-        self.commands = [
-            BotCommand(
-                command="help",
-                description=get_reply_text("help_description"),
-            ),
+        commands_description = [
+            f"/{command.command} - {command.description}" for command in self.COMMANDS
         ]
-        self.last_report_data = ""
-        self.last_report = []
+        self._help_text = (
+            "\n\n".join(get_reply_text("help_text"))
+            + "\n\n"
+            + "\n".join(commands_description)
+        )
+        # очереди отчётов по чатам: отчёты одного чата обрабатываются по порядку,
+        # а разные чаты не ждут друг друга
+        self._chat_queues: dict[int, asyncio.Queue] = {}
+        # отчёты для группового чата отправляются отдельной задачей с ограничением
+        # частоты, чтобы не упираться в общий лимит Telegram на отправку
+        self._group_outbox: asyncio.Queue = asyncio.Queue()
+        self._group_sender_active = False
+        self._allow_all = config["allowed_user_ids"] == "*"
+        # ids are parsed once, the permission checks run on every update
+        config.setdefault("admin_user_id_set", parse_user_ids(config["admin_user_ids"]))
+        config.setdefault(
+            "allowed_user_id_set", parse_user_ids(config["allowed_user_ids"])
+        )
 
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
@@ -59,17 +105,8 @@ class AgroReportTelegramBot:
         if not await self.check_allowed(update, context):
             return
 
-        commands = self.commands
-        commands_description = [
-            f"/{command.command} - {command.description}" for command in commands
-        ]
-        help_text = ""
-        for text in get_reply_text("help_text"):
-            help_text += f"{text}\n\n"
-
-        help_text += "\n".join(commands_description)
         await update.message.reply_text(
-            help_text,
+            self._help_text,
             parse_mode=constants.ParseMode.MARKDOWN,
             disable_web_page_preview=True,
         )
@@ -85,8 +122,11 @@ class AgroReportTelegramBot:
         :param context: Telegram context object
         :return: Boolean indicating if the user is allowed to use the bot
         """
-        name = update.message.from_user.name
-        user_id = update.message.from_user.id
+        if self._allow_all:
+            return True
+
+        user = update.message.from_user
+        name, user_id = user.name, user.id
 
         if not await is_allowed(self.config, update, context):
             logger.warning(f"User {name} (id: {user_id}) is not allowed to use the bot")
@@ -113,13 +153,11 @@ class AgroReportTelegramBot:
         if query.data == "final_yes":
             corrected = context.user_data.get("corrected_entries")
             if corrected:
-                self.last_report = corrected
-            for item in self.last_report:
-
-                item["Дата"] = datetime.strptime(
-                    item["Дата"], "%d.%m.%Y"
-                )
-            insert_objects(self.last_report)
+                context.user_data["last_report"] = corrected
+            last_report = context.user_data.get("last_report", [])
+            for item in last_report:
+                item["Дата"] = parse_report_date(item["Дата"])
+            insert_objects(last_report)
 
             await context.bot.send_message(
                 chat_id=query.message.chat_id,
@@ -135,6 +173,7 @@ class AgroReportTelegramBot:
             )
 
         context.user_data.pop("corrected_entries", None)
+        context.user_data.pop("last_report", None)
         await query.edit_message_reply_markup(reply_markup=None)
 
     async def prompt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -175,83 +214,79 @@ class AgroReportTelegramBot:
             # Если остались исправления
             if correction_data["current_index"] < len(queue):
                 next_entry_idx, next_key = queue[correction_data["current_index"]]
-                entry_number = next_entry_idx + 1
                 await update.message.reply_text(
-                    f"""Запись {entry_number}. Нераспознанные данные: ```
-{entries[next_entry_idx]['Данные']}```
-
-Введите значение для поля '{next_key}':""",
+                    CORRECTION_PROMPT.format(
+                        number=next_entry_idx + 1,
+                        data=entries[next_entry_idx]["Данные"],
+                        key=next_key,
+                    ),
                     parse_mode=constants.ParseMode.MARKDOWN,
                 )
             else:
                 # Все исправления завершены
                 context.user_data.pop("awaiting_correction", None)
-                needs_val = False
-                for entry in entries:
-                    if entry["Операция"] == "Уборка":
-                        needs_val = True
-                for entry in entries:
-                    entry.pop("Данные", None)
-                    if not needs_val:
-                        entry.pop("Вал с начала, ц", None)
-                        entry.pop("Вал за день, ц", None)
-                    else:
-                        entry["Вал с начала, ц"] = entry["Вал с начала, ц"] / 100
-                        entry["Вал за день, ц"] = entry["Вал за день, ц"] / 100
-
+                needs_val = any(entry["Операция"] == "Уборка" for entry in entries)
                 context.user_data["corrected_entries"] = entries
-
-                formatted_report = (
-                    f"<pre>{pd.DataFrame(entries).to_string(index=False)}</pre>"
-                )
-                formatted_report = re.sub(r'<!--.*?-->', '', formatted_report, flags=re.DOTALL)
-                keyboard = [
-                    [
-                        InlineKeyboardButton(
-                            "Финальный отчёт ✅", callback_data="final_yes"
-                        ),
-                        InlineKeyboardButton(
-                            "Промежуточный отчёт ⚠️", callback_data="final_no"
-                        ),
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
-                    formatted_report,
-                    reply_markup=reply_markup,
-                    parse_mode=constants.ParseMode.HTML,
-                )
-                group_report = f"""Отчёт от {update.effective_user.full_name}:\n\n{formatted_report}
-    Исходный текст:
-
-    {self.last_report_data}"""
-                await context.bot.send_message(
-                    chat_id=self.config["group_chat_id"],
-                    text=group_report,
-                    parse_mode=constants.ParseMode.HTML,
-                    disable_web_page_preview=True,
+                await self._finalize_and_send(
+                    update,
+                    context,
+                    entries,
+                    context.user_data.get("last_report_data", ""),
+                    needs_val,
                 )
-                self.last_report_data = ""
+                context.user_data["last_report_data"] = ""
             return
 
+        chat_id = update.effective_chat.id
+        queue = self._chat_queues.get(chat_id)
+        if queue is None:
+            queue = self._chat_queues[chat_id] = asyncio.Queue()
+            context.application.create_task(
+                self._process_chat_queue(chat_id), update=update
+            )
+        queue.put_nowait((update, context))
+
+    async def _process_chat_queue(self, chat_id: int) -> None:
+        """
+        Processes queued reports of a single chat one by one.
+        The queue is removed once it is drained.
+        """
+        queue = self._chat_queues[chat_id]
+        while not queue.empty():
+            update, context = queue.get_nowait()
+            try:
+                await self._process_report(update, context)
+            except Exception:
+                logger.exception(f"Failed to process report in chat {chat_id}")
+        del self._chat_queues[chat_id]
+
+    async def _process_report(
+        self, update: Update, context: ContextTypes.DEFAULT_TYPE
+    ) -> None:
+        """
+        Builds a report from the message and sends it to the user and the group chat.
+        """
         # Обработка входящих сообщений
         chat_id = update.effective_chat.id
         query_text = message_text(update) or ""
         sent_message = None
-        logger.info(
-            f"New message received from user {update.message.from_user.name} (id: {update.message.from_user.id})"
-        )
+        user = update.message.from_user
+        logger.info("New message received from user %s (id: %s)", user.name, user.id)
 
         # Обработка вложений
         file = update.message.document
         photo = update.message.photo
         if file or photo:
+            # загрузка и разбор файла идут параллельно с ответом пользователю
+            attachment_task = asyncio.create_task(
+                manage_attachment(update, context, file, photo)
+            )
             sent_message = await update.effective_message.reply_text(
                 "Файл обрабатывается 🤖", reply_to_message_id=update.message.message_id
             )
             try:
-                file_content = await manage_attachment(update, context, file, photo)
-                logger.info(file_content)
+                file_content = await attachment_task
+                logger.debug("Attachment parsed: %.200s", file_content)
                 query_text = f"""[ТАБЛИЦА]:\n{file_content}\n\n{query_text}"""
 
             except Exception:
@@ -277,101 +312,145 @@ class AgroReportTelegramBot:
                 "Формирую отчёт 📝",
             )
 
-        self.last_report_data = query_text
-        self.last_report = await send_and_receive(query_text)
+        context.user_data["last_report_data"] = query_text
+        try:
+            last_report = await send_and_receive(query_text)
+        except asyncio.TimeoutError:
+            logger.error("No reply from the workers for chat %s", chat_id)
+            last_report = ERROR_TEXT
+        context.user_data["last_report"] = last_report
 
-        if self.last_report != ERROR_TEXT:
+        if last_report != ERROR_TEXT:
 
             logger.info("Report ready!")
             # Проверка на необходимость исправлений
+            # один проход: очередь исправлений и признак уборки
             corrections_queue = []
-            for entry_idx, entry in enumerate(self.last_report):
+            needs_val = False
+            for entry_idx, entry in enumerate(last_report):
+                if entry.get("Операция") == "Уборка":
+                    needs_val = True
+                # большинство записей распознано полностью, проверяем их без цикла
+                if UNDEFINED not in entry.values():
+                    continue
                 for key, value in entry.items():
-                    if value == "Не определено":
+                    if value == UNDEFINED:
                         corrections_queue.append((entry_idx, key))
 
             if corrections_queue:
                 context.user_data["corrections"] = {
-                    "entries": self.last_report,
+                    "entries": last_report,
                     "queue": corrections_queue,
                     "current_index": 0,
                 }
                 context.user_data["awaiting_correction"] = True
                 first_entry_idx, first_key = corrections_queue[0]
                 await update.message.reply_text(
-                    f"""При заполнении отчёта не удалось распознать некоторые значения, требуется уточнение.
-
-Запись {first_entry_idx + 1}. Нераспознанные данные: ```
-{self.last_report[first_entry_idx]['Данные']}```
-
-Введите значение для поля '{first_key}':
-""",
+                    CORRECTION_HEADER
+                    + CORRECTION_PROMPT.format(
+                        number=first_entry_idx + 1,
+                        data=last_report[first_entry_idx]["Данные"],
+                        key=first_key,
+                    ),
                     parse_mode=constants.ParseMode.MARKDOWN,
                 )
                 return
 
             # Если исправления не требуются
-            needs_val = False
-            for entry in self.last_report:
-                if entry["Операция"] == "Уборка":
-                    needs_val = True
-            for entry in self.last_report:
-                entry.pop("Данные", None)
-                if not needs_val:
-                    entry.pop("Вал с начала, ц", None)
-                    entry.pop("Вал за день, ц", None)
-                else:
-                    entry["Вал с начала, ц"] = entry["Вал с начала, ц"] / 100
-                    entry["Вал за день, ц"] = entry["Вал за день, ц"] / 100
-
-            formatted_report = (
-                f"<pre>{pd.DataFrame(self.last_report).to_string(index=False)}</pre>"
+            await self._finalize_and_send(
+                update, context, last_report, query_text, needs_val, sent_message
             )
-            keyboard = [
-                [
-                    InlineKeyboardButton(
-                        "Финальный отчёт ✅", callback_data="final_yes"
-                    ),
-                    InlineKeyboardButton(
-                        "Промежуточный отчёт ⚠️", callback_data="final_no"
-                    ),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        else:
             await edit_message_with_retry(
                 context,
                 chat_id,
                 str(sent_message.message_id),
-                formatted_report,
-                reply_markup=reply_markup,
+                last_report,
                 html=True,
             )
+        context.user_data["last_report_data"] = ""
 
-            group_report = f"""Отчёт от {update.effective_user.full_name}:\n\n{formatted_report}
-Исходный текст:
+    async def _finalize_and_send(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        entries: list[dict],
+        source_text: str,
+        needs_val: bool,
+        sent_message=None,
+    ) -> None:
+        """
+        Cleans up report entries and sends the final report to the user and the group chat.
+        :param entries: Report entries, modified in place
+        :param source_text: Original report text for the group chat
+        :param needs_val: Whether the report contains harvest entries with yield fields
+        :param sent_message: Status message to replace with the report, a new reply is sent if None
+        """
+        for entry in entries:
+            del entry["Данные"]
+            if not needs_val:
+                entry.pop("Вал с начала, ц", None)
+                entry.pop("Вал за день, ц", None)
+            else:
+                entry["Вал с начала, ц"] /= 100
+                entry["Вал за день, ц"] /= 100
 
-{query_text}"""
-            await context.bot.send_message(
-                chat_id=self.config["group_chat_id"],
-                text=group_report,
-                parse_mode=constants.ParseMode.HTML,
-                disable_web_page_preview=True,
-            )
-        else:
+        formatted_report = HTML_COMMENT_RE.sub(
+            "", f"<pre>{format_table(entries)}</pre>"
+        )
+        if sent_message:
             await edit_message_with_retry(
                 context,
-                chat_id,
+                update.effective_chat.id,
                 str(sent_message.message_id),
-                self.last_report,
+                formatted_report,
+                reply_markup=FINAL_KEYBOARD,
                 html=True,
             )
-        self.last_report_data = ""
+        else:
+            await update.message.reply_text(
+                formatted_report,
+                reply_markup=FINAL_KEYBOARD,
+                parse_mode=constants.ParseMode.HTML,
+            )
+
+        group_report = compose_group_report(
+            update.effective_user.full_name, formatted_report, source_text
+        )
+        self._send_to_group(context, group_report)
+
+    def _send_to_group(self, context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+        """
+        Queues a report for the group chat and starts the sender if it is idle.
+        """
+        self._group_outbox.put_nowait(text)
+        if not self._group_sender_active:
+            self._group_sender_active = True
+            context.application.create_task(self._drain_group_outbox(context.bot))
+
+    async def _drain_group_outbox(self, bot) -> None:
+        """
+        Sends queued group chat reports no faster than GROUP_SEND_INTERVAL.
+        """
+        while not self._group_outbox.empty():
+            text = self._group_outbox.get_nowait()
+            try:
+                await bot.send_message(
+                    chat_id=self.config["group_chat_id"],
+                    text=text,
+                    parse_mode=constants.ParseMode.HTML,
+                    disable_web_page_preview=True,
+                )
+            except Exception:
+                logger.exception("Failed to send report to the group chat")
+            await asyncio.sleep(GROUP_SEND_INTERVAL)
+        self._group_sender_active = False
 
     async def post_init(self, application: Application) -> None:
         """
         Post initialization hook for the bot.
         """
-        await application.bot.set_my_commands(self.commands)
+        await application.bot.set_my_commands(self.COMMANDS)
 
     def run(self):
         """
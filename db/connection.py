@@ -24,12 +24,20 @@ url_object = URL.create(
 def get_engine():
     global engine
     if engine is None:
-        engine = create_engine(url_object)
+        # pre_ping and recycle drop connections the server closed while idle,
+        # lifo keeps reusing the few recently active connections
+        engine = create_engine(
+            url_object,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            pool_use_lifo=True,
+            connect_args={"options": "-c statement_timeout=30000"},
+        )
     return engine
 
 
 engine = get_engine()
-Session = sessionmaker(bind=engine)
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 
 
 @contextmanager
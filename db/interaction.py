@@ -1,6 +1,6 @@
-from db.connection import session_scope
+from db.connection import get_engine, session_scope
 from db.models import OperationInfo
-import pandas as pd
+from sqlalchemy import select
 
 mapping = {
     "Дата": "date",
@@ -15,26 +15,24 @@ mapping = {
 
 
 def get_all_operations():
-    with session_scope() as session:
-        data = session.query(OperationInfo).all()
-        records = [model.to_dict() for model in data]
-        df = pd.DataFrame(records)
-        return df
+    # pandas нужен только дашборду, бот импортирует модуль ради insert_objects
+    import pandas as pd
+
+    # колонки сразу получают русские названия, ORM-объекты не создаются
+    columns = [
+        getattr(OperationInfo, column).label(name) for name, column in mapping.items()
+    ]
+    query = select(OperationInfo.id, *columns)
+    return pd.read_sql(query, get_engine())
 
 
 def insert_objects(records):
+    mapped_records = [
+        {mapping[key]: value for key, value in record.items() if key in mapping}
+        for record in records
+    ]
     with session_scope() as session:
-        mapped_records = []
-        for record in records:
-            mapped_fields = {}
-            for key, value in record.items():
-                column_name = mapping.get(key)
-                if column_name:
-                    mapped_fields[column_name] = value
-            mapped_records.append(mapped_fields)
-        objects = [OperationInfo(**record) for record in mapped_records]
-        session.bulk_save_objects(objects)
-        session.commit()
+        session.bulk_insert_mappings(OperationInfo, mapped_records)
 
 
 def update_record_by_id(record_id, new_data):
@@ -51,23 +49,9 @@ def update_record_by_id(record_id, new_data):
         )
 
         if record:
-            if "Дата" in new_data:
-                record.date = new_data["Дата"]
-            if "Подразделение" in new_data:
-                record.unit = new_data["Подразделение"]
-            if "Операция" in new_data:
-                record.operation = new_data["Операция"]
-            if "Культура" in new_data:
-                record.cultura = new_data["Культура"]
-            if "За день, га" in new_data:
-                record.GA_per_day = new_data["За день, га"]
-            if "С начала операции, га" in new_data:
-                record.GA_per_operation = new_data["С начала операции, га"]
-            if "Вал за день, ц" in new_data:
-                record.val_per_day = new_data["Вал за день, ц"]
-            if "Вал с начала, ц" in new_data:
-                record.val_per_operation = new_data["Вал с начала, ц"]
-            session.commit()
+            for name, column in mapping.items():
+                if name in new_data:
+                    setattr(record, column, new_data[name])
             return record
         else:
             return None